@@ -308,10 +308,7 @@ class BisimAgent(object):
 
         if step % self.critic_target_update_freq == 0:
             utils.soft_update_params(
-                self.critic.Q1, self.critic_target.Q1, self.critic_tau
-            )
-            utils.soft_update_params(
-                self.critic.Q2, self.critic_target.Q2, self.critic_tau
+                self.critic.Q, self.critic_target.Q, self.critic_tau
             )
             utils.soft_update_params(
                 self.critic.encoder, self.critic_target.encoder, self.encoder_tau
@@ -4,6 +4,10 @@
 # This source code is licensed under the license found in the
 # LICENSE file in the root directory of this source tree.
 
+import math
+from collections import Counter
+from contextlib import nullcontext
+
 import numpy as np
 import torch
 import torch.nn as nn
@@ -11,8 +15,28 @@ import torch.nn.functional as F
 
 import utils
 from sac_ae import Actor, Critic, weight_init, LOG_FREQ
-from transition_model import make_transition_model
-from decoder import make_decoder
+from transition_model import (
+    make_transition_model,
+    EnsembleOfProbabilisticTransitionModels,
+)
+from decoder import make_decoder, FusedRewardHead
+
+try:
+    import torch_tensorrt
+except ImportError:
+    torch_tensorrt = None
+
+
+class GreedyPolicy(nn.Module):
+    """Deterministic actor output, the fixed-shape graph built for TensorRT."""
+
+    def __init__(self, actor):
+        super().__init__()
+        self.actor = actor
+
+    def forward(self, obs):
+        mu, _, _, _ = self.actor(obs, compute_pi=False, compute_log_pi=False)
+        return mu
 
 
 class DeepMDPAgent(object):
@@ -49,6 +73,10 @@ class DeepMDPAgent(object):
         transition_model_type="deterministic",
         num_layers=4,
         num_filters=32,
+        compile=False,
+        cuda_graph=False,
+        amp=False,
+        trt_inference=False,
     ):
         self.reconstruction = False
         if decoder_type == "reconstruction":
@@ -62,6 +90,49 @@ class DeepMDPAgent(object):
         self.critic_target_update_freq = critic_target_update_freq
         self.decoder_update_freq = decoder_update_freq
         self.decoder_type = decoder_type
+        self.compile = compile
+        # compiled "reduce-overhead" modules already run as CUDA graphs
+        assert not (compile and cuda_graph), "pick one of compile and cuda_graph"
+        self.cuda_graph = cuda_graph and torch.cuda.is_available()
+        self.cuda_graph = self.cuda_graph and torch.device(device).type == "cuda"
+        self._batch_size = None
+        # eager calls per update step before it is captured, see _graphed
+        self._graph_warmup_steps = 3
+        self._graph_calls = Counter()
+        self._graphs = {}
+        self._graph_outputs = {}
+        # update() repeats the same branches every _update_period steps
+        self._update_period = 1
+        for freq in (actor_update_freq, critic_target_update_freq, decoder_update_freq):
+            self._update_period *= freq // math.gcd(self._update_period, freq)
+        # mixed precision: bfloat16 where supported, else float16 with loss
+        # scaling; a disabled GradScaler passes losses and steps through
+        self.amp = amp and torch.device(device).type == "cuda"
+        self._amp_dtype = torch.bfloat16
+        if self.amp and not torch.cuda.is_bf16_supported():
+            self._amp_dtype = torch.float16
+        self._scaler = torch.cuda.amp.GradScaler(
+            enabled=self.amp and self._amp_dtype == torch.float16
+        )
+        # decoder_optimizer steps for both the model and the reconstruction
+        # loss, and a scaler may step an optimizer only once per update()
+        self._decoder_scaler = torch.cuda.amp.GradScaler(
+            enabled=self._scaler.is_enabled()
+        )
+        # the scaler's inf checks sync with the host, which can't be captured
+        assert not (self.cuda_graph and self._scaler.is_enabled())
+        # persistent per-step tensors, see _scratch_buffer
+        self._scratch = {}
+        # pinned staging buffers for the per-env-step host <-> device copies
+        self._pinned = torch.device(device).type == "cuda"
+        self._obs_pinned = torch.empty((1, *obs_shape), pin_memory=self._pinned)
+        self._obs_gpu = torch.empty_like(self._obs_pinned, device=device)
+        self._act_pinned = torch.empty(action_shape, pin_memory=self._pinned)
+        # side stream for the next_obs encodings that don't depend on the actor;
+        # compiled modules manage their own streams
+        self._target_stream = None
+        if self._pinned and not compile:
+            self._target_stream = torch.cuda.Stream()
 
         self.actor = Actor(
             obs_shape,
@@ -103,25 +174,55 @@ class DeepMDPAgent(object):
         self.transition_model = make_transition_model(
             transition_model_type, encoder_feature_dim, action_shape
         ).to(device)
-
-        self.reward_decoder = nn.Sequential(
-            nn.Linear(encoder_feature_dim + action_shape[0], 512),
-            nn.LayerNorm(512),
-            nn.ReLU(),
-            nn.Linear(512, 1),
+        if self.cuda_graph and isinstance(
+            self.transition_model, EnsembleOfProbabilisticTransitionModels
+        ):
+            # the decoder step samples from the ensemble inside the graph
+            self.transition_model.sample_on_device = True
+
+        # torch.compile fuses the eager ops itself, so only script when not compiling
+        self.reward_decoder = FusedRewardHead(
+            encoder_feature_dim + action_shape[0],
+            512,
+            fused=torch.device(device).type == "cuda" and not (compile or self.amp),
         ).to(device)
 
-        decoder_params = list(self.transition_model.parameters()) + list(
-            self.reward_decoder.parameters()
-        )
+        # only the pixel decoder is weight decayed, the transition and reward
+        # models are not regularized
+        decoder_param_groups = [
+            {"params": self.transition_model.parameters(), "weight_decay": 0.0},
+            {"params": self.reward_decoder.parameters(), "weight_decay": 0.0},
+        ]
 
         # tie encoders between actor and critic
         self.actor.encoder.copy_conv_weights_from(self.critic.encoder)
 
+        # the soft-updated networks and their targets each live in one flat
+        # buffer, so a target update is a single lerp per network
+        self._soft_update_buckets = [
+            (
+                source,
+                target,
+                tau,
+                utils.flatten_params_(source),
+                utils.flatten_params_(target),
+            )
+            for source, target, tau in (
+                (self.critic.Q, self.critic_target.Q, critic_tau),
+                (self.critic.encoder, self.critic_target.encoder, encoder_tau),
+            )
+        ]
+
         self.log_alpha = torch.tensor(np.log(init_temperature)).to(device)
         self.log_alpha.requires_grad = True
+        # detached alpha, refreshed in place after every alpha step so CUDA
+        # graphs keep reading the same tensor
+        self._alpha = self.log_alpha.detach().exp()
         # set target entropy to -|A|
         self.target_entropy = -np.prod(action_shape)
+        self._target_entropy_t = torch.tensor(float(self.target_entropy), device=device)
+        # constant part of the diagonal gaussian entropy, computed once
+        self._entropy_const = 0.5 * action_shape[0] * (1.0 + math.log(2 * math.pi))
 
         self.decoder = None
         if decoder_type == "pixel":
@@ -130,30 +231,83 @@ class DeepMDPAgent(object):
                 decoder_type, obs_shape, encoder_feature_dim, num_layers, num_filters
             ).to(device)
             self.decoder.apply(weight_init)
-            decoder_params += list(self.decoder.parameters())
+            decoder_param_groups.append(
+                {
+                    "params": self.decoder.parameters(),
+                    "weight_decay": decoder_weight_lambda,
+                }
+            )
 
-        self.decoder_optimizer = torch.optim.Adam(
-            decoder_params, lr=decoder_lr, weight_decay=decoder_weight_lambda
-        )
+        # fused Adam (a single kernel per step) needs CUDA params, otherwise
+        # fall back to the multi-tensor foreach implementation
+        fused = torch.device(device).type == "cuda"
+        adam_kwargs = dict(fused=fused, foreach=not fused)
 
-        # optimizer for critic encoder for reconstruction loss
-        self.encoder_optimizer = torch.optim.Adam(
-            self.critic.encoder.parameters(), lr=encoder_lr
+        # the critic encoder and the decoders are always stepped together (for
+        # the transition/reward and reconstruction losses), so they share one
+        # optimizer with a param group each
+        self.decoder_optimizer = torch.optim.Adam(
+            [{"params": self.critic.encoder.parameters(), "lr": encoder_lr}]
+            + decoder_param_groups,
+            lr=decoder_lr,
+            capturable=self.cuda_graph,
+            **adam_kwargs,
         )
 
         # optimizers
+        # the optimizers stepped inside CUDA graphs must be capturable
         self.actor_optimizer = torch.optim.Adam(
-            self.actor.parameters(), lr=actor_lr, betas=(actor_beta, 0.999)
+            self.actor.parameters(),
+            lr=actor_lr,
+            betas=(actor_beta, 0.999),
+            capturable=self.cuda_graph,
+            **adam_kwargs,
         )
 
         self.critic_optimizer = torch.optim.Adam(
-            self.critic.parameters(), lr=critic_lr, betas=(critic_beta, 0.999)
+            self.critic.parameters(),
+            lr=critic_lr,
+            betas=(critic_beta, 0.999),
+            capturable=self.cuda_graph,
+            **adam_kwargs,
         )
 
         self.log_alpha_optimizer = torch.optim.Adam(
-            [self.log_alpha], lr=alpha_lr, betas=(alpha_beta, 0.999)
+            [self.log_alpha],
+            lr=alpha_lr,
+            betas=(alpha_beta, 0.999),
+            capturable=self.cuda_graph,
+            **adam_kwargs,
         )
 
+        # TensorRT engine for select_action, built lazily once and refitted
+        # with the new weights on the first select_action after they change
+        self.trt_inference = trt_inference and torch.device(device).type == "cuda"
+        if self.trt_inference and torch_tensorrt is None:
+            print("torch_tensorrt not found, select_action stays in PyTorch.")
+            self.trt_inference = False
+        self._actor_trt = None
+        self._actor_trt_stale = False
+
+        self._actor_forward = self._act
+        if compile:
+            # compile in place so parameter names (and checkpoints) are unchanged
+            # the critics' encoders and heads are also called separately
+            for module in (
+                self.actor,
+                self.critic.encoder,
+                self.critic.Q,
+                self.critic_target.encoder,
+                self.critic_target.Q,
+                self.transition_model,
+                self.reward_decoder,
+            ):
+                if isinstance(module, nn.Module):
+                    module.compile(mode="reduce-overhead", fullgraph=False)
+            # separate compiled entry point so the batch=1 rollout graph is
+            # captured independently of the training batch
+            self._actor_forward = torch.compile(self._act, mode="reduce-overhead")
+
         self.train()
         self.critic_target.train()
 
@@ -168,159 +322,405 @@ class DeepMDPAgent(object):
     def alpha(self):
         return self.log_alpha.exp()
 
+    def _autocast(self, cache_enabled=True):
+        return torch.autocast(
+            torch.device(self.device).type,
+            dtype=self._amp_dtype,
+            enabled=self.amp,
+            cache_enabled=cache_enabled,
+        )
+
+    def _scratch_buffer(self, name, shape):
+        """Return a persistent buffer, reallocated only when the shape changes."""
+        buf = self._scratch.get(name)
+        if buf is None or buf.shape != shape:
+            buf = torch.empty(shape, device=self.device)
+            self._scratch[name] = buf
+        return buf
+
+    def _act(self, obs, sample):
+        mu, pi, _, _ = self.actor(obs, compute_pi=sample, compute_log_pi=False)
+        return pi if sample else mu
+
+    def _static_batch(self, *batch):
+        """Copy a sampled batch into the persistent inputs of the CUDA graphs."""
+        return tuple(
+            self._scratch_buffer("batch_%d" % i, x.shape).copy_(x, non_blocking=True)
+            for i, x in enumerate(batch)
+        )
+
+    def _graphed(self, name, fn, *args):
+        """Run an update step, replaying a CUDA graph of it after warmup.
+
+        Tensor ``args`` must be persistent, the graph reads them in place.
+        Returns the dict of tensors to log, which the graph overwrites on
+        every replay.
+        """
+        if not self.cuda_graph:
+            return fn(*args)
+
+        # eager warmup steps let cuBLAS/cuDNN and the optimizer state settle
+        self._graph_calls[name] += 1
+        if self._graph_calls[name] <= self._graph_warmup_steps:
+            return fn(*args)
+
+        if name not in self._graphs:
+            # grads have to be allocated by the graph itself, not accumulated
+            # into tensors that may be freed before the next replay
+            for optimizer in (
+                self.actor_optimizer,
+                self.critic_optimizer,
+                self.log_alpha_optimizer,
+                self.decoder_optimizer,
+            ):
+                optimizer.zero_grad(set_to_none=True)
+            graph = torch.cuda.CUDAGraph()
+            with torch.cuda.graph(graph):
+                self._graph_outputs[name] = fn(*args)
+            self._graphs[name] = graph
+
+        self._graphs[name].replay()
+        return self._graph_outputs[name]
+
+    def _obs_to_device(self, obs):
+        self._obs_pinned.copy_(torch.as_tensor(obs).unsqueeze(0))
+        return self._obs_gpu.copy_(self._obs_pinned, non_blocking=True)
+
+    def _action_to_host(self, action):
+        # the returned array is a view of the pinned buffer and is overwritten
+        # by the next call, copy it to keep it around
+        self._act_pinned.copy_(action.squeeze(0), non_blocking=True)
+        if self._pinned:
+            torch.cuda.current_stream().synchronize()
+        return self._act_pinned.numpy()
+
+    def _greedy_action(self, obs):
+        if not self.trt_inference:
+            return self._actor_forward(obs, False)
+        if self._actor_trt is None:
+            self._actor_trt = torch_tensorrt.compile(
+                GreedyPolicy(self.actor),
+                ir="dynamo",
+                inputs=[obs],
+                enabled_precisions={torch.float32, torch.float16},
+                immutable_weights=False,
+            )
+        elif self._actor_trt_stale:
+            # swapping the new weights into the engine is much cheaper than
+            # building a new one at every evaluation
+            self._actor_trt = torch_tensorrt.dynamo.refit_module_weights(
+                self._actor_trt,
+                torch.export.export(GreedyPolicy(self.actor), (obs,)),
+            )
+        self._actor_trt_stale = False
+        return self._actor_trt(obs)
+
+    def _mark_step(self):
+        # reduce-overhead compiled modules (compile=True, and the encoders
+        # make_encoder returns) replay CUDAGraph Trees, whose outputs are
+        # overwritten once a new generation starts; start one per update() or
+        # action, so outputs stay valid until that call is done
+        torch.compiler.cudagraph_mark_step_begin()
+
     def select_action(self, obs):
+        self._mark_step()
         with torch.no_grad():
-            obs = torch.FloatTensor(obs).to(self.device)
-            obs = obs.unsqueeze(0)
-            mu, _, _, _ = self.actor(obs, compute_pi=False, compute_log_pi=False)
-            return mu.cpu().data.numpy().flatten()
+            obs = self._obs_to_device(obs)
+            mu = self._greedy_action(obs)
+            return self._action_to_host(mu)
 
     def sample_action(self, obs):
+        self._mark_step()
         with torch.no_grad():
-            obs = torch.FloatTensor(obs).to(self.device)
-            obs = obs.unsqueeze(0)
-            mu, pi, _, _ = self.actor(obs, compute_log_pi=False)
-            return pi.cpu().data.numpy().flatten()
+            obs = self._obs_to_device(obs)
+            pi = self._actor_forward(obs, True)
+            return self._action_to_host(pi)
+
+    def _critic_and_model_step(
+        self, obs, action, reward, next_obs, not_done, L=None, step=None
+    ):
+        # the target block is an autocast region of its own: the actor casts
+        # its conv weights, which are the critic encoder's, under no_grad, and
+        # autocast's cache would hand those history-free copies to the critic
+        # encoder below; closing the region clears the cache
+        with torch.no_grad(), self._autocast():
+            # the encodings of next_obs by the target critic and the critic
+            # overlap with the actor forward on the side stream
+            side_stream = nullcontext()
+            if self._target_stream is not None:
+                self._target_stream.wait_stream(torch.cuda.current_stream())
+                side_stream = torch.cuda.stream(self._target_stream)
+            # the actor's conv weights are the critic encoder's, and the
+            # actor reads autocast's cached copies without waiting on the
+            # side stream, so the side stream casts without caching
+            with side_stream, self._autocast(cache_enabled=self._target_stream is None):
+                # the latents outlive later compiled calls, so they are
+                # cloned out of the CUDA graph pool
+                target_h = self.critic_target.encoder(next_obs).clone()
+                # the transition target is never differentiated
+                next_h = self.critic.encoder(next_obs).clone()
 
-    def update_critic(self, obs, action, reward, next_obs, not_done, L, step):
-        with torch.no_grad():
             _, policy_action, log_pi, _ = self.actor(next_obs)
-            target_Q1, target_Q2 = self.critic_target(next_obs, policy_action)
-            target_V = torch.min(target_Q1, target_Q2) - self.alpha.detach() * log_pi
-            target_Q = reward + (not_done * self.discount * target_V)
-
-        # get current Q estimates
-        current_Q1, current_Q2 = self.critic(obs, action, detach_encoder=False)
-        critic_loss = F.mse_loss(current_Q1, target_Q) + F.mse_loss(
-            current_Q2, target_Q
+            policy_action, log_pi = policy_action.clone(), log_pi.clone()
+
+            if self._target_stream is not None:
+                current_stream = torch.cuda.current_stream()
+                current_stream.wait_stream(self._target_stream)
+                target_h.record_stream(current_stream)
+                next_h.record_stream(current_stream)
+
+            target_Q1, target_Q2 = self.critic_target.forward_latent(
+                target_h, policy_action
+            )
+            target_V = torch.min(target_Q1, target_Q2)
+            target_V.sub_(self._alpha * log_pi)
+            target_Q = self._scratch_buffer("target_Q", reward.shape)
+            torch.mul(not_done, target_V, out=target_Q)
+            target_Q.mul_(self.discount).add_(reward)
+
+        with self._autocast():
+            # one encoder pass on obs feeds both the critic and the
+            # transition/reward model
+            h = self.critic.encoder(obs)
+
+            # get current Q estimates
+            current_Q = self.critic.forward_latent(h, action)
+            # one reduction over both stacked heads; the mean over the stack is
+            # rescaled to the sum of the per-head losses
+            critic_loss = current_Q.size(0) * F.mse_loss(
+                current_Q, target_Q.expand_as(current_Q)
+            )
+
+            # h carries grad, so the concat can't be written into a scratch
+            # buffer (out= ops don't support autograd); build it once instead
+            h_action = torch.cat([h, action], dim=1)
+            pred_next_latent_mu, pred_next_latent_sigma = self.transition_model(
+                h_action
+            )
+            if pred_next_latent_sigma is None:
+                # deterministic model: unit sigma, so there is no scale and no
+                # log term
+                diff = pred_next_latent_mu - next_h
+                transition_loss = 0.5 * diff.pow(2).mean()
+            else:
+                diff = (pred_next_latent_mu - next_h) / pred_next_latent_sigma
+                transition_loss = torch.mean(
+                    0.5 * diff.pow(2) + torch.log(pred_next_latent_sigma)
+                )
+
+            pred_next_reward = self.reward_decoder(h_action)
+            reward_loss = F.mse_loss(pred_next_reward, reward)
+            model_loss = transition_loss + reward_loss
+
+        # both losses reach the shared encoder but through different
+        # optimizers, so take the model gradients before the critic steps
+        model_params = [
+            p for group in self.decoder_optimizer.param_groups for p in group["params"]
+        ]
+        model_grads = torch.autograd.grad(
+            self._scaler.scale(model_loss),
+            model_params,
+            retain_graph=True,
+            allow_unused=True,
         )
-        L.log("train_critic/loss", critic_loss, step)
 
         # Optimize the critic
-        self.critic_optimizer.zero_grad()
-        critic_loss.backward()
-        self.critic_optimizer.step()
+        self.critic_optimizer.zero_grad(set_to_none=True)
+        self._scaler.scale(critic_loss).backward()
+        self._scaler.step(self.critic_optimizer)
 
-        self.critic.log(L, step)
+        # log while the critic outputs and grads are still the critic loss's,
+        # the actor and model updates overwrite them
+        if L is not None:
+            self.critic.log(L, step)
 
-    def update_actor_and_alpha(self, obs, L, step):
-        # detach encoder, so we don't update it with the actor loss
-        _, pi, log_pi, log_std = self.actor(obs, detach_encoder=True)
-        actor_Q1, actor_Q2 = self.critic(obs, pi, detach_encoder=True)
+        # Optimize the encoder and the transition/reward model
+        for param, grad in zip(model_params, model_grads):
+            param.grad = grad
+        self._scaler.step(self.decoder_optimizer)
 
-        actor_Q = torch.min(actor_Q1, actor_Q2)
-        actor_loss = (self.alpha.detach() * log_pi - actor_Q).mean()
+        return {
+            "train_critic/loss": critic_loss,
+            "train_ae/transition_loss": transition_loss,
+        }
 
-        L.log("train_actor/loss", actor_loss, step)
-        L.log("train_actor/target_entropy", self.target_entropy, step)
-        entropy = 0.5 * log_std.shape[1] * (1.0 + np.log(2 * np.pi)) + log_std.sum(
-            dim=-1
-        )
-        L.log("train_actor/entropy", entropy.mean(), step)
+    def _actor_and_alpha_step(self, obs):
+        with self._autocast():
+            # detach encoder, so we don't update it with the actor loss
+            _, pi, log_pi, log_std = self.actor(obs, detach_encoder=True)
+            actor_Q1, actor_Q2 = self.critic(obs, pi, detach_encoder=True)
+
+            actor_Q = torch.min(actor_Q1, actor_Q2)
+            actor_loss = (self._alpha * log_pi - actor_Q).mean()
+
+            entropy = log_std.sum(dim=-1).add_(self._entropy_const)
 
         # optimize the actor
-        self.actor_optimizer.zero_grad()
-        actor_loss.backward()
-        self.actor_optimizer.step()
-
-        self.actor.log(L, step)
-
-        self.log_alpha_optimizer.zero_grad()
-        alpha_loss = (self.alpha * (-log_pi - self.target_entropy).detach()).mean()
-        L.log("train_alpha/loss", alpha_loss, step)
-        L.log("train_alpha/value", self.alpha, step)
-        alpha_loss.backward()
-        self.log_alpha_optimizer.step()
-
-    def update_transition_reward_model(self, obs, action, next_obs, reward, L, step):
-        h = self.critic.encoder(obs)
-        pred_next_latent_mu, pred_next_latent_sigma = self.transition_model(
-            torch.cat([h, action], dim=1)
-        )
-        if pred_next_latent_sigma is None:
-            pred_next_latent_sigma = torch.ones_like(pred_next_latent_mu)
-
-        next_h = self.critic.encoder(next_obs)
-        diff = (pred_next_latent_mu - next_h.detach()) / pred_next_latent_sigma
-        loss = torch.mean(0.5 * diff.pow(2) + torch.log(pred_next_latent_sigma))
-        L.log("train_ae/transition_loss", loss, step)
-
-        pred_next_reward = self.reward_decoder(torch.cat([h, action], dim=1))
-        reward_loss = F.mse_loss(pred_next_reward, reward)
-        total_loss = loss + reward_loss
-        self.encoder_optimizer.zero_grad()
-        self.decoder_optimizer.zero_grad()
-        total_loss.backward()
-        self.encoder_optimizer.step()
-        self.decoder_optimizer.step()
-
-    def update_decoder(
-        self, obs, action, target_obs, L, step
-    ):  #  uses transition model
-        # image might be stacked, just grab the first 3 (rgb)!
+        self.actor_optimizer.zero_grad(set_to_none=True)
+        self._scaler.scale(actor_loss).backward()
+        self._scaler.step(self.actor_optimizer)
+
+        self.log_alpha_optimizer.zero_grad(set_to_none=True)
+        alpha = self.log_alpha.exp()
+        alpha_loss = (alpha * (-log_pi - self._target_entropy_t).detach()).mean()
+        self._scaler.scale(alpha_loss).backward()
+        self._scaler.step(self.log_alpha_optimizer)
+        torch.exp(self.log_alpha.detach(), out=self._alpha)
+
+        return {
+            "train_actor/loss": actor_loss,
+            "train_actor/entropy": entropy.mean(),
+            "train_alpha/loss": alpha_loss,
+            "train_alpha/value": alpha.detach(),
+        }
+
+    def _decoder_step(self, obs, action, target_obs):  #  uses transition model
         assert target_obs.dim() == 4
-        target_obs = target_obs[:, :3, :, :]
 
-        h = self.critic.encoder(obs)
-        if not self.reconstruction:
-            next_h = self.transition_model.sample_prediction(
-                torch.cat([h, action], dim=1)
-            )
-            if target_obs.dim() == 4:
-                # preprocess images to be in [-0.5, 0.5] range
-                target_obs = utils.preprocess_obs(target_obs)
-            rec_obs = self.decoder(next_h)
-            loss = F.mse_loss(target_obs, rec_obs)
-        else:
-            rec_obs = self.decoder(h)
-            loss = F.mse_loss(obs, rec_obs)
+        with self._autocast():
+            h = self.critic.encoder(obs)
+            if not self.reconstruction:
+                next_h = self.transition_model.sample_prediction(
+                    torch.cat([h, action], dim=1)
+                )
+                # image might be stacked, just grab the first 3 (rgb)! and
+                # preprocess to be in [-0.5, 0.5] range; the fused op reads the
+                # strided slice directly, so it isn't copied first
+                target_obs = utils.preprocess_obs(target_obs[:, :3])
+                rec_obs = self.decoder(next_h)
+                loss = F.mse_loss(target_obs, rec_obs)
+            else:
+                rec_obs = self.decoder(h)
+                loss = F.mse_loss(obs, rec_obs)
+
+        self.decoder_optimizer.zero_grad(set_to_none=True)
+        self._decoder_scaler.scale(loss).backward()
+
+        self._decoder_scaler.step(self.decoder_optimizer)
+
+        return {"train_ae/ae_loss": loss}
+
+    def _soft_update_targets(self):
+        for i, bucket in enumerate(self._soft_update_buckets):
+            source, target, tau, flat, target_flat = bucket
+            if flat is None:
+                utils.soft_update_params(source, target, tau)
+                continue
+            # flatten again rather than lerp a buffer the parameters left
+            if not (
+                utils.shares_flat_buffer(source, flat)
+                and utils.shares_flat_buffer(target, target_flat)
+            ):
+                flat = utils.flatten_params_(source)
+                target_flat = utils.flatten_params_(target)
+                self._soft_update_buckets[i] = (source, target, tau, flat, target_flat)
+            target_flat.lerp_(flat, tau)
+
+    def _update_step(
+        self, phase, obs, action, reward, next_obs, not_done, L=None, step=None
+    ):
+        """All updates made at steps with ``step % _update_period == phase``.
 
-        self.encoder_optimizer.zero_grad()
-        self.decoder_optimizer.zero_grad()
-        loss.backward()
+        The critic is logged to ``L`` halfway through, if it is given.
+        """
+        metrics = self._critic_and_model_step(
+            obs, action, reward, next_obs, not_done, L, step
+        )
+
+        if phase % self.actor_update_freq == 0:
+            metrics.update(self._actor_and_alpha_step(obs))
 
-        self.encoder_optimizer.step()
-        self.decoder_optimizer.step()
-        L.log("train_ae/ae_loss", loss, step)
+        if phase % self.critic_target_update_freq == 0:
+            self._soft_update_targets()
 
-        self.decoder.log(L, step, log_freq=LOG_FREQ)
+        if (
+            self.decoder is not None and phase % self.decoder_update_freq == 0
+        ):  # decoder_type is pixel
+            metrics.update(self._decoder_step(obs, action, next_obs))
+
+        return metrics
 
     def update(self, replay_buffer, L, step):
-        obs, action, _, reward, next_obs, not_done = replay_buffer.sample()
+        self._mark_step()
+        # the engine has the actor weights baked in
+        self._actor_trt_stale = True
 
-        L.log("train/batch_reward", reward.mean(), step)
+        obs, action, _, reward, next_obs, not_done = replay_buffer.sample()
 
-        self.update_critic(obs, action, reward, next_obs, not_done, L, step)
-        self.update_transition_reward_model(obs, action, next_obs, reward, L, step)
+        if self.compile or self.cuda_graph:
+            # compiled graphs are specialized on the batch shape
+            if self._batch_size is None:
+                self._batch_size = obs.size(0)
+            assert obs.size(0) == self._batch_size
 
-        if step % self.actor_update_freq == 0:
-            self.update_actor_and_alpha(obs, L, step)
+        L.log("train/batch_reward", reward.mean(), step)
 
-        if step % self.critic_target_update_freq == 0:
-            utils.soft_update_params(
-                self.critic.Q1, self.critic_target.Q1, self.critic_tau
+        if self.cuda_graph:
+            obs, action, reward, next_obs, not_done = self._static_batch(
+                obs, action, reward, next_obs, not_done
             )
-            utils.soft_update_params(
-                self.critic.Q2, self.critic_target.Q2, self.critic_tau
-            )
-            utils.soft_update_params(
-                self.critic.encoder, self.critic_target.encoder, self.encoder_tau
+
+        # the update frequencies all divide _update_period, so the phase alone
+        # decides which updates run and each phase gets its own graph
+        phase = step % self._update_period
+        args = (phase, obs, action, reward, next_obs, not_done)
+        if step % LOG_FREQ == 0:
+            # the critic is logged in the middle of the step, which a graph
+            # replay can't do, so logging steps run eagerly
+            metrics = self._update_step(*args, L=L, step=step)
+        else:
+            metrics = self._graphed("update_%d" % phase, self._update_step, *args)
+        for key, value in metrics.items():
+            L.log(key, value, step)
+
+        if phase % self.actor_update_freq == 0:
+            L.log("train_actor/target_entropy", self.target_entropy, step)
+            self.actor.log(L, step)
+        if self.decoder is not None and phase % self.decoder_update_freq == 0:
+            self.decoder.log(L, step, log_freq=LOG_FREQ)
+            self._decoder_scaler.update()
+
+        # one loss-scale update per step, after every optimizer has stepped
+        self._scaler.update()
+
+    def quantize_for_inference(self):
+        """Replace the reward decoder and transition model by int8 versions.
+
+        Dynamic quantization only has CPU kernels, so both models are moved to
+        the CPU and expect CPU inputs afterwards. Meant for deploying a trained
+        agent; the quantized models can't be trained further.
+        """
+
+        def quantize(module):
+            return torch.ao.quantization.quantize_dynamic(
+                module.cpu(), {nn.Linear}, dtype=torch.qint8
             )
 
-        if (
-            self.decoder is not None and step % self.decoder_update_freq == 0
-        ):  # decoder_type is pixel
-            self.update_decoder(obs, action, next_obs, L, step)
+        self.reward_decoder = quantize(self.reward_decoder)
+        if isinstance(self.transition_model, nn.Module):
+            self.transition_model = quantize(self.transition_model)
+        else:  # ensemble
+            self.transition_model.models = [
+                quantize(model) for model in self.transition_model.models
+            ]
 
     def save(self, model_dir, step):
-        torch.save(self.actor.state_dict(), "%s/actor_%s.pt" % (model_dir, step))
-        torch.save(self.critic.state_dict(), "%s/critic_%s.pt" % (model_dir, step))
+        # the weights are views of the flat soft-update buffers, and the actor's
+        # conv weights of the critic encoder's; saving a view writes its whole
+        # buffer, so each file gets copies of just its own weights
+        def state_dict(module):
+            return {k: v.clone() for k, v in module.state_dict().items()}
+
+        torch.save(state_dict(self.actor), "%s/actor_%s.pt" % (model_dir, step))
+        torch.save(state_dict(self.critic), "%s/critic_%s.pt" % (model_dir, step))
         if self.decoder is not None:
             torch.save(
                 self.decoder.state_dict(), "%s/decoder_%s.pt" % (model_dir, step)
             )
 
     def load(self, model_dir, step):
+        # the engine has the old actor weights baked in
+        self._actor_trt_stale = True
         self.actor.load_state_dict(torch.load("%s/actor_%s.pt" % (model_dir, step)))
         self.critic.load_state_dict(torch.load("%s/critic_%s.pt" % (model_dir, step)))
         if self.decoder is not None:
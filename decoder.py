@@ -6,6 +6,7 @@
 
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 
 
 class PixelDecoder(nn.Module):
@@ -75,6 +76,33 @@ class PixelDecoder(nn.Module):
         L.log_param("train_decoder/fc", self.fc, step)
 
 
+@torch.jit.script
+def fused_ln_relu(x, weight, bias, eps: float = 1e-5):
+    """LayerNorm followed by ReLU, scripted so the pointwise ops fuse."""
+    return F.relu(F.layer_norm(x, [weight.size(0)], weight, bias, eps))
+
+
+class FusedRewardHead(nn.Module):
+    """Reward decoder, Linear -> LayerNorm -> ReLU -> Linear."""
+
+    def __init__(self, feature_dim, hidden_dim=512, fused=True):
+        super().__init__()
+
+        self.fc1 = nn.Linear(feature_dim, hidden_dim)
+        self.ln = nn.LayerNorm(hidden_dim)
+        self.fc2 = nn.Linear(hidden_dim, 1)
+        # the scripted path only pays off on GPU, keep eager ops on CPU
+        self.fused = fused
+
+    def forward(self, x):
+        x = self.fc1(x)
+        if self.fused:
+            x = fused_ln_relu(x, self.ln.weight, self.ln.bias, self.ln.eps)
+        else:
+            x = torch.relu(self.ln(x))
+        return self.fc2(x)
+
+
 _AVAILABLE_DECODERS = {"pixel": PixelDecoder}
 
 
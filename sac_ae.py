@@ -38,6 +38,14 @@ def weight_init(m):
     if isinstance(m, nn.Linear):
         nn.init.orthogonal_(m.weight.data)
         m.bias.data.fill_(0.0)
+    elif isinstance(m, GroupedLinear):
+        for w in m.weight.data:
+            nn.init.orthogonal_(w)
+        m.bias.data.fill_(0.0)
+    elif isinstance(m, QTwin):
+        # init each head's slice of the shared input layer on its own
+        for w in m.fc1.weight.data.view(m.num_q, -1, m.fc1.in_features):
+            nn.init.orthogonal_(w)
     elif isinstance(m, nn.LSTM):
         for name, p in m.named_parameters():
             if "lstm" in name:
@@ -148,25 +156,39 @@ class Actor(nn.Module):
         L.log_param("train_actor/fc3", self.trunk[4], step)
 
 
-class QFunction(nn.Module):
-    """MLP for q-function."""
+class GroupedLinear(nn.Module):
+    """Independent linear layers applied to a stacked (groups, B, in) input."""
 
-    def __init__(self, obs_dim, action_dim, hidden_dim):
+    def __init__(self, groups, in_features, out_features):
         super().__init__()
 
-        self.trunk = nn.Sequential(
-            nn.Linear(obs_dim + action_dim, hidden_dim),
-            nn.ReLU(),
-            nn.Linear(hidden_dim, hidden_dim),
-            nn.ReLU(),
-            nn.Linear(hidden_dim, 1),
-        )
+        self.weight = nn.Parameter(torch.empty(groups, in_features, out_features))
+        self.bias = nn.Parameter(torch.empty(groups, out_features))
+
+    def forward(self, x):
+        return torch.baddbmm(self.bias.unsqueeze(1), x, self.weight)
+
+
+class QTwin(nn.Module):
+    """Twin MLP q-functions evaluated together as grouped GEMMs."""
+
+    def __init__(self, obs_dim, action_dim, hidden_dim, num_q=2):
+        super().__init__()
+
+        self.num_q = num_q
+        # the heads share their input, so the first layer is one wide Linear
+        self.fc1 = nn.Linear(obs_dim + action_dim, num_q * hidden_dim)
+        self.fc2 = GroupedLinear(num_q, hidden_dim, hidden_dim)
+        self.fc3 = GroupedLinear(num_q, hidden_dim, 1)
 
     def forward(self, obs, action):
         assert obs.size(0) == action.size(0)
 
         obs_action = torch.cat([obs, action], dim=1)
-        return self.trunk(obs_action)
+        h = torch.relu(self.fc1(obs_action))
+        h = h.view(h.size(0), self.num_q, -1).transpose(0, 1)
+        h = torch.relu(self.fc2(h))
+        return self.fc3(h)
 
 
 class Critic(nn.Module):
@@ -194,8 +216,7 @@ class Critic(nn.Module):
             stride,
         )
 
-        self.Q1 = QFunction(self.encoder.feature_dim, action_shape[0], hidden_dim)
-        self.Q2 = QFunction(self.encoder.feature_dim, action_shape[0], hidden_dim)
+        self.Q = QTwin(self.encoder.feature_dim, action_shape[0], hidden_dim)
 
         self.outputs = dict()
         self.apply(weight_init)
@@ -203,14 +224,17 @@ class Critic(nn.Module):
     def forward(self, obs, action, detach_encoder=False):
         # detach_encoder allows to stop gradient propogation to encoder
         obs = self.encoder(obs, detach=detach_encoder)
+        return self.forward_latent(obs, action)
 
-        q1 = self.Q1(obs, action)
-        q2 = self.Q2(obs, action)
+    def forward_latent(self, h, action):
+        """Q-values of already encoded observations."""
+        # stacked (2, B, 1), so `q1, q2 = critic(obs, action)` still unpacks
+        q = self.Q(h, action)
 
-        self.outputs["q1"] = q1
-        self.outputs["q2"] = q2
+        self.outputs["q1"] = q[0]
+        self.outputs["q2"] = q[1]
 
-        return q1, q2
+        return q
 
     def log(self, L, step, log_freq=LOG_FREQ):
         if step % log_freq != 0:
@@ -221,6 +245,5 @@ class Critic(nn.Module):
         for k, v in self.outputs.items():
             L.log_histogram("train_critic/%s_hist" % k, v, step)
 
-        for i in range(3):
-            L.log_param("train_critic/q1_fc%d" % i, self.Q1.trunk[i * 2], step)
-            L.log_param("train_critic/q2_fc%d" % i, self.Q2.trunk[i * 2], step)
+        for i, fc in enumerate((self.Q.fc1, self.Q.fc2, self.Q.fc3)):
+            L.log_param("train_critic/q_fc%d" % i, fc, step)
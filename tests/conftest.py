@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the agents import the top-level modules (utils, sac_ae, ...) by name
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,180 @@
+import numpy as np
+import pytest
+import torch
+
+import utils
+from agent import deepmdp_agent
+from agent.deepmdp_agent import DeepMDPAgent
+from logger import Logger
+
+# the pixel decoder reconstructs 84x420 frames, which the Carla 0.9.6 encoder
+# reads with the default 4 layers and stride 2
+CARLA_OBS_SHAPE = (9, 84, 420)
+OBS_SHAPE = (9, 84, 84)
+ACTION_SHAPE = (2,)
+
+requires_cuda = pytest.mark.skipif(not torch.cuda.is_available(), reason="needs CUDA")
+
+
+def make_replay_buffer(obs_shape, device, batch_size=8):
+    replay_buffer = utils.ReplayBuffer(
+        obs_shape, ACTION_SHAPE, capacity=16, batch_size=batch_size, device=device
+    )
+    for _ in range(16):
+        obs = np.random.randint(0, 256, obs_shape, dtype=np.uint8)
+        next_obs = np.random.randint(0, 256, obs_shape, dtype=np.uint8)
+        action = np.random.uniform(-1, 1, ACTION_SHAPE).astype(np.float32)
+        reward = np.random.rand()
+        replay_buffer.add(obs, action, reward, reward, next_obs, False)
+    return replay_buffer
+
+
+@requires_cuda
+def test_fp16_update_with_pixel_decoder(monkeypatch, tmp_path):
+    # force float16 with loss scaling, even on GPUs that support bfloat16
+    monkeypatch.setattr(torch.cuda, "is_bf16_supported", lambda: False)
+    agent = DeepMDPAgent(
+        CARLA_OBS_SHAPE,
+        ACTION_SHAPE,
+        device="cuda",
+        encoder_type="pixelCarla096",
+        decoder_type="pixel",
+        amp=True,
+    )
+    assert agent._scaler.is_enabled()
+
+    replay_buffer = make_replay_buffer(CARLA_OBS_SHAPE, "cuda")
+    L = Logger(str(tmp_path), use_tb=False)
+    # the model and the reconstruction loss both step the decoder optimizer
+    for step in range(2 * agent._update_period):
+        agent.update(replay_buffer, L, step)
+
+
+@requires_cuda
+def test_amp_critic_and_model_step_trains_the_encoder():
+    # no pixel decoder, so the conv encoder only learns from this step
+    agent = DeepMDPAgent(
+        OBS_SHAPE, ACTION_SHAPE, device="cuda", decoder_type="identity", amp=True
+    )
+    obs, action, _, reward, next_obs, not_done = make_replay_buffer(
+        OBS_SHAPE, "cuda"
+    ).sample()
+
+    agent._critic_and_model_step(obs, action, reward, next_obs, not_done)
+
+    grad = agent.critic.encoder.convs[0].weight.grad
+    assert grad is not None
+    assert grad.abs().sum() > 0
+
+
+@requires_cuda
+def test_compiled_updates_and_actions(tmp_path):
+    agent = DeepMDPAgent(OBS_SHAPE, ACTION_SHAPE, device="cuda", compile=True)
+    replay_buffer = make_replay_buffer(OBS_SHAPE, "cuda")
+    L = Logger(str(tmp_path), use_tb=False)
+    obs = np.random.randint(0, 256, OBS_SHAPE, dtype=np.uint8)
+
+    # step 0 also logs, which reads the outputs of the compiled modules
+    for step in range(2 * agent._update_period + 1):
+        agent.update(replay_buffer, L, step)
+        assert agent.select_action(obs).shape == ACTION_SHAPE
+        assert agent.sample_action(obs).shape == ACTION_SHAPE
+
+
+def make_cpu_agent():
+    return DeepMDPAgent(
+        OBS_SHAPE,
+        ACTION_SHAPE,
+        device="cpu",
+        decoder_type="identity",
+        critic_tau=0.1,
+        encoder_tau=0.05,
+    )
+
+
+def test_flat_soft_update_matches_polyak_average():
+    agent = make_cpu_agent()
+    with torch.no_grad():
+        for param in agent.critic.parameters():
+            param.add_(torch.randn_like(param))
+
+    pairs = [
+        (agent.critic.Q, agent.critic_target.Q, 0.1),
+        (agent.critic.encoder, agent.critic_target.encoder, 0.05),
+    ]
+    expected = [
+        [tau * p + (1 - tau) * t for p, t in zip(net.parameters(), target.parameters())]
+        for net, target, tau in pairs
+    ]
+    agent._soft_update_targets()
+
+    for (_, target, _), target_expected in zip(pairs, expected):
+        for param, param_expected in zip(target.parameters(), target_expected):
+            torch.testing.assert_close(param, param_expected)
+
+
+def test_soft_update_reflattens_rebound_params():
+    agent = make_cpu_agent()
+    # assign=True rebinds the parameters to the (cloned) tensors instead of
+    # copying into them
+    state_dict = {k: v.clone() for k, v in agent.critic.Q.state_dict().items()}
+    agent.critic.Q.load_state_dict(state_dict, assign=True)
+    _, _, _, flat, _ = agent._soft_update_buckets[0]
+    assert not utils.shares_flat_buffer(agent.critic.Q, flat)
+
+    agent._soft_update_targets()
+
+    for net, target, _, flat, target_flat in agent._soft_update_buckets:
+        assert utils.shares_flat_buffer(net, flat)
+        assert utils.shares_flat_buffer(target, target_flat)
+
+
+def test_save_and_load_keep_flat_buffers_and_tied_weights(tmp_path):
+    agent = make_cpu_agent()
+    agent.save(str(tmp_path), 0)
+    # each tensor is saved on its own, not with the buffer it is a view of
+    for value in torch.load(str(tmp_path / "actor_0.pt")).values():
+        assert value.untyped_storage().nbytes() == value.numel() * value.element_size()
+
+    loaded = make_cpu_agent()
+    loaded.load(str(tmp_path), 0)
+
+    torch.testing.assert_close(loaded.critic.state_dict(), agent.critic.state_dict())
+    for net, target, _, flat, target_flat in loaded._soft_update_buckets:
+        assert flat is not None
+        assert utils.shares_flat_buffer(net, flat)
+        assert utils.shares_flat_buffer(target, target_flat)
+    for actor_conv, critic_conv in zip(
+        loaded.actor.encoder.convs, loaded.critic.encoder.convs
+    ):
+        assert actor_conv.weight is critic_conv.weight
+        assert actor_conv.bias is critic_conv.bias
+
+
+@requires_cuda
+def test_trt_inference_falls_back_without_torch_tensorrt(monkeypatch):
+    monkeypatch.setattr(deepmdp_agent, "torch_tensorrt", None)
+    agent = DeepMDPAgent(OBS_SHAPE, ACTION_SHAPE, device="cuda", trt_inference=True)
+    assert not agent.trt_inference
+
+    obs = np.random.randint(0, 256, OBS_SHAPE, dtype=np.uint8)
+    assert agent.select_action(obs).shape == ACTION_SHAPE
+
+
+@requires_cuda
+@pytest.mark.skipif(deepmdp_agent.torch_tensorrt is None, reason="needs torch_tensorrt")
+def test_trt_engine_is_refitted_after_load(tmp_path):
+    agent = DeepMDPAgent(OBS_SHAPE, ACTION_SHAPE, device="cuda", trt_inference=True)
+    other = DeepMDPAgent(OBS_SHAPE, ACTION_SHAPE, device="cuda")
+    other.save(str(tmp_path), 0)
+    obs = np.random.randint(0, 256, OBS_SHAPE, dtype=np.uint8)
+    obs_t = torch.as_tensor(obs, device="cuda").unsqueeze(0).float()
+
+    agent.select_action(obs)
+    agent.load(str(tmp_path), 0)
+    action = agent.select_action(obs).copy()
+
+    with torch.no_grad():
+        expected = other._act(obs_t, False).squeeze(0).cpu().numpy()
+    # the engine may run float16 kernels
+    np.testing.assert_allclose(action, expected, atol=1e-2)
@@ -61,6 +61,30 @@ def parse_args():
         "--bisim_coef", default=0.5, type=float, help="coefficient for bisim terms"
     )
     parser.add_argument("--load_encoder", default=None, type=str)
+    parser.add_argument(
+        "--compile",
+        default=False,
+        action="store_true",
+        help="torch.compile the deepmdp networks",
+    )
+    parser.add_argument(
+        "--cuda_graph",
+        default=False,
+        action="store_true",
+        help="capture the deepmdp actor/critic updates as CUDA graphs",
+    )
+    parser.add_argument(
+        "--amp",
+        default=False,
+        action="store_true",
+        help="train the deepmdp agent with mixed precision",
+    )
+    parser.add_argument(
+        "--trt_inference",
+        default=False,
+        action="store_true",
+        help="run deepmdp evaluation actions through a TensorRT engine",
+    )
     # eval
     parser.add_argument("--eval_freq", default=10, type=int)  # TODO: master had 10000
     parser.add_argument("--num_eval_episodes", default=20, type=int)
@@ -319,6 +343,10 @@ def make_agent(obs_shape, action_shape, args, device):
             transition_model_type=args.transition_model_type,
             num_layers=args.num_layers,
             num_filters=args.num_filters,
+            compile=args.compile,
+            cuda_graph=args.cuda_graph,
+            amp=args.amp,
+            trt_inference=args.trt_inference,
         )
 
     if args.load_encoder:
@@ -495,7 +523,7 @@ def collect_data(env, agent, num_rollouts, path_length, checkpoint_path):
             action = agent.sample_action(observation)
             next_observation, reward, terminated, truncated, _ = env.step(action)
             obses.append(observation)
-            acs.append(action)
+            acs.append(np.copy(action))
             rews.append(reward)
             observation = next_observation
         obses.append(next_observation)
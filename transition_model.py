@@ -79,6 +79,9 @@ class EnsembleOfProbabilisticTransitionModels(object):
             )
             for _ in range(ensemble_size)
         ]
+        # draw the member on the device instead, for callers that capture
+        # sample_prediction in a CUDA graph; runs every member, so off by default
+        self.sample_on_device = False
         print("Ensemble of probabilistic transition models chosen.")
 
     def __call__(self, x):
@@ -88,8 +91,15 @@ class EnsembleOfProbabilisticTransitionModels(object):
         return mus, sigmas
 
     def sample_prediction(self, x):
-        model = random.choice(self.models)
-        return model.sample_prediction(x)
+        if not self.sample_on_device:
+            model = random.choice(self.models)
+            return model.sample_prediction(x)
+        # a host-side choice would be baked into a captured graph
+        mus, sigmas = self(x)
+        idx = torch.randint(len(self.models), (1,), device=mus.device)
+        mu, sigma = mus.index_select(0, idx)[0], sigmas.index_select(0, idx)[0]
+        eps = torch.randn_like(sigma)
+        return mu + sigma * eps
 
     def to(self, device):
         for model in self.models:
@@ -7,6 +7,7 @@
 import torch
 import numpy as np
 import torch.nn as nn
+from torch._utils import _flatten_dense_tensors, _unflatten_dense_tensors
 import gymnasium as gym
 import os
 from collections import deque
@@ -30,8 +31,39 @@ class eval_mode(object):
 
 
 def soft_update_params(net, target_net, tau):
-    for param, target_param in zip(net.parameters(), target_net.parameters()):
-        target_param.data.copy_(tau * param.data + (1 - tau) * target_param.data)
+    target_params = list(target_net.parameters())
+    if not target_params:
+        return
+    with torch.no_grad():
+        # target <- target + tau * (param - target), one multi-tensor kernel
+        torch._foreach_lerp_(target_params, list(net.parameters()), tau)
+
+
+def flatten_params_(module):
+    """Move the parameters of a module into one contiguous buffer.
+
+    The parameters become views of the returned flat tensor, so pointwise
+    updates of the whole module (e.g. soft updates) run as a single kernel.
+    Returns None if the module has no parameters, or contains an RNN, which
+    manages its own flat cuDNN weight buffer.
+    """
+    params = list(module.parameters())
+    if not params or any(isinstance(m, nn.RNNBase) for m in module.modules()):
+        return None
+    flat = _flatten_dense_tensors([p.data for p in params])
+    for p, view in zip(params, _unflatten_dense_tensors(flat, params)):
+        p.data = view
+    return flat
+
+
+def shares_flat_buffer(module, flat):
+    """Whether the parameters of a module are still views of ``flat``.
+
+    Rebinding parameter data (``.to()`` to another device,
+    ``load_state_dict(assign=True)``) silently detaches them from the buffer.
+    """
+    ptr = flat.untyped_storage().data_ptr()
+    return all(p.untyped_storage().data_ptr() == ptr for p in module.parameters())
 
 
 def set_seed_everywhere(seed):
@@ -57,16 +89,17 @@ def make_dir(dir_path):
     return dir_path
 
 
-def preprocess_obs(obs, bits=5):
-    """Preprocessing image, see https://arxiv.org/abs/1807.03039."""
-    bins = 2**bits
+@torch.jit.script
+def preprocess_obs(obs, bits: int = 5):
+    """Preprocessing image, see https://arxiv.org/abs/1807.03039.
+
+    Scripted so the pointwise chain fuses into a single kernel on GPU.
+    """
+    bins = 2.0**bits
     assert obs.dtype == torch.float32
     if bits < 8:
-        obs = torch.floor(obs / 2 ** (8 - bits))
-    obs = obs / bins
-    obs = obs + torch.rand_like(obs) / bins
-    obs = obs - 0.5
-    return obs
+        obs = torch.floor(obs / 2.0 ** (8 - bits))
+    return obs / bins + torch.rand_like(obs) / bins - 0.5
 
 
 class ReplayBuffer(object):